@@ -3,12 +3,14 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import contextlib
 import logging
 import sys
 import os
+import weakref
 
 import torch
-from fairseq import utils
+from fairseq import sequence_scorer
 
 
 logging.basicConfig(
@@ -24,7 +26,6 @@ def get_differentiable_embedding_hook():
 
     def differentiable_embedding_hook(module, input, output):
         output.requires_grad_(True)
-        output.retain_grad()
         gradients["upstream"] = output
         gradients["local"] = module.weight
         return output
@@ -32,8 +33,28 @@ def get_differentiable_embedding_hook():
     return differentiable_embedding_hook, gradients
 
 
-class SequenceScorer(object):
-    """Scores the target for a given source sentence."""
+@contextlib.contextmanager
+def frozen_parameters(model):
+    """Disable gradients of all parameters of *model* within the context.
+
+    Only gradients w.r.t. the embedding output are needed. With frozen
+    weights autograd neither saves activations that are only used for
+    weight gradients nor records the parts of the decoder that do not
+    depend on the source embeddings.
+    """
+    params = [p for p in model.parameters() if p.requires_grad]
+    for p in params:
+        p.requires_grad_(False)
+    try:
+        yield
+    finally:
+        for p in params:
+            p.requires_grad_(True)
+
+
+class SequenceScorer(sequence_scorer.SequenceScorer):
+    """Scores the target for a given source sentence, and reports the norm of
+    the Jacobian of each score w.r.t. the one-hot encoded source tokens."""
 
     def __init__(
         self,
@@ -42,146 +63,85 @@ class SequenceScorer(object):
         compute_alignment=False,
         eos=None,
         symbols_to_strip_from_output=None,
+        amp=False,
     ):
-        self.pad = tgt_dict.pad()
-        self.eos = tgt_dict.eos() if eos is None else eos
-        self.softmax_batch = softmax_batch or sys.maxsize
-        assert self.softmax_batch > 0
-        self.compute_alignment = compute_alignment
-        self.symbols_to_strip_from_output = (
-            symbols_to_strip_from_output.union({self.eos})
-            if symbols_to_strip_from_output is not None
-            else {self.eos}
+        super().__init__(
+            tgt_dict,
+            softmax_batch=softmax_batch,
+            compute_alignment=compute_alignment,
+            eos=eos,
+            symbols_to_strip_from_output=symbols_to_strip_from_output,
         )
+        # bf16 rather than fp16 autocast: the backward pass runs without a
+        # loss scaler, and bf16 keeps the fp32 exponent range
+        self.amp = amp
+        # W^T W of each model's embedding matrix, keyed by id(weight) so that
+        # ensembles do not evict each other. Entries are dropped when their
+        # weight is freed (so a new model reusing the id never sees them) and
+        # are validated on storage and version against in-place updates.
+        self._gram_cache = {}
+        self._gradients = None
+
+    def _embedding_gram(self, weight):
+        """Return the (D, D) Gram matrix W^T W of a (V, D) embedding matrix."""
+        key = (weight.data_ptr(), weight._version, weight.shape)
+        cached_key, gram = self._gram_cache.get(id(weight), (None, None))
+        if cached_key != key:
+            if cached_key is None:
+                # weakref.WeakKeyDictionary cannot be used: it compares
+                # tensor keys with ==, which is elementwise
+                weakref.finalize(weight, self._gram_cache.pop, id(weight), None)
+            w = weight.detach().float()
+            gram = torch.matmul(w.t(), w)
+            self._gram_cache[id(weight)] = (key, gram)
+        return gram
+
+    @torch.no_grad()
+    def _jacobian_norm(self, grad, weight):
+        """Per-sample Frobenius norm of ``grad @ weight.T`` without forming it.
+
+        ``||G W^T||^2 = sum_t g_t (W^T W) g_t^T``, so only the (D, D) Gram
+        matrix is needed instead of a (B, T, V) tensor. The projection is
+        linear, so it is applied to the gradient after the backward pass
+        rather than being differentiated through.
+        """
+        gram = self._embedding_gram(weight)
+        # reduce in fp32 regardless of the precision of the forward pass
+        grad = grad.float().reshape(grad.size(0), -1, grad.size(-1))
+        sq_norm = (torch.matmul(grad, gram) * grad).sum(dim=(1, 2))
+        return sq_norm.clamp_min(0).sqrt()
+
+    def forward_model(self, model, net_input):
+        differentiable_embedding_hook, self._gradients = get_differentiable_embedding_hook()
+        handle = model.encoder.embed_tokens.register_forward_hook(differentiable_embedding_hook)
+        try:
+            with frozen_parameters(model), torch.autocast(
+                device_type=net_input["src_tokens"].device.type,
+                dtype=torch.bfloat16,
+                enabled=self.amp,
+            ):
+                return model(**net_input)
+        finally:
+            handle.remove()
 
-    #@torch.no_grad()
     def generate(self, models, sample, **kwargs):
         """Score a batch of translations."""
-        net_input = sample["net_input"]
-
-        def batch_for_softmax(dec_out, target):
-            # assumes decoder_out[0] is the only thing needed (may not be correct for future models!)
-            first, rest = dec_out[0], dec_out[1:]
-            bsz, tsz, dim = first.shape
-            if bsz * tsz < self.softmax_batch:
-                yield dec_out, target, True
-            else:
-                flat = first.contiguous().view(1, -1, dim)
-                flat_tgt = target.contiguous().view(flat.shape[:-1])
-                s = 0
-                while s < flat.size(1):
-                    e = s + self.softmax_batch
-                    yield (flat[:, s:e],) + rest, flat_tgt[:, s:e], False
-                    s = e
-
-        def gather_target_probs(probs, target):
-            probs = probs.gather(
-                dim=2,
-                index=target.unsqueeze(-1),
-            )
-            return probs
-
-        orig_target = sample["target"]
-
-        # compute scores for each model in the ensemble
-        avg_probs = None
-        avg_attn = None
-        for model in models:
-            model.eval()
-            differentiable_embedding_hook, gradients_dict = get_differentiable_embedding_hook()
-            handle = model.encoder.embed_tokens.register_forward_hook(differentiable_embedding_hook)
-            decoder_out = model(**net_input)
-            attn = decoder_out[1] if len(decoder_out) > 1 else None
-            if type(attn) is dict:
-                attn = attn.get("attn", None)
-
-            batched = batch_for_softmax(decoder_out, orig_target)
-            probs, idx = None, 0
-            handle.remove()
-            for bd, tgt, is_single in batched:
-                sample["target"] = tgt
-                curr_prob = model.get_normalized_probs(
-                    bd, log_probs=len(models) == 1, sample=sample
-                ) #.data
-                if is_single:
-                    probs = gather_target_probs(curr_prob, orig_target)
-                else:
-                    if probs is None:
-                        probs = curr_prob.new(orig_target.numel())
-                    step = curr_prob.size(0) * curr_prob.size(1)
-                    end = step + idx
-                    tgt_probs = gather_target_probs(
-                        curr_prob.view(tgt.shape + (curr_prob.size(-1),)), tgt
-                    )
-                    probs[idx:end] = tgt_probs.view(-1)
-                    idx = end
-                sample["target"] = orig_target
-
-            probs = probs.view(sample["target"].shape)
-
-            if avg_probs is None:
-                avg_probs = probs
-            else:
-                avg_probs.add_(probs)
-            if attn is not None:
-                if torch.is_tensor(attn):
-                    attn = attn.data
-                else:
-                    attn = attn[0]
-                if avg_attn is None:
-                    avg_attn = attn
-                else:
-                    avg_attn.add_(attn)
-        if len(models) > 1:
-            avg_probs.div_(len(models))
-            avg_probs.log_()
-            if avg_attn is not None:
-                avg_attn.div_(len(models))
-
-        bsz = avg_probs.size(0)
-        hypos = []
-        start_idxs = sample["start_indices"] if "start_indices" in sample else [0] * bsz
-        for i in range(bsz):
-            # remove padding from ref
-            ref = (
-                utils.strip_pad(sample["target"][i, start_idxs[i] :], self.pad)
-                if sample["target"] is not None
-                else None
-            )
-            tgt_len = ref.numel()
-            avg_probs_i = avg_probs[i][start_idxs[i] : start_idxs[i] + tgt_len]
-            score_i = avg_probs_i.sum() / tgt_len
-            score_i.backward(gradient=torch.ones_like(score_i), retain_graph=True)
-            if avg_attn is not None:
-                avg_attn_i = avg_attn[i]
-                if self.compute_alignment:
-                    alignment = utils.extract_hard_alignment(
-                        avg_attn_i,
-                        sample["net_input"]["src_tokens"][i],
-                        sample["target"][i],
-                        self.pad,
-                        self.eos,
-                    )
-                else:
-                    alignment = None
-            else:
-                avg_attn_i = alignment = None
-                
-            jacobian = torch.matmul(gradients_dict["upstream"].grad, gradients_dict["local"].T)
-            hypos.append(
-                [
-                    {
-                        "tokens": ref,
-                        "score": score_i,
-                        "attention": avg_attn_i,
-                        "alignment": alignment,
-                        "positional_scores": avg_probs_i,
-                        "jacobian": torch.norm(
-                            jacobian.data.view(avg_probs.shape[0], -1),
-                            p=2,
-                            dim=1,
-                        ).tolist()
-                    }
-                ]
-            )
+        avg_probs, avg_attn = self.score_models(models, sample)
+        scores = self.sequence_scores(sample, avg_probs)
+        hypos = self.build_hypos(sample, avg_probs, avg_attn, scores)
+
+        # Samples do not interact in the forward pass, so a single backward
+        # of the summed scores yields every per-sample gradient at once.
+        (upstream_grad,) = torch.autograd.grad(
+            scores.sum(), self._gradients["upstream"]
+        )
+        jacobian_norm = self._jacobian_norm(
+            upstream_grad, self._gradients["local"]
+        ).tolist()
+        self._gradients = None
+
+        bsz = len(hypos)
+        for i, hypos_i in enumerate(hypos):
+            # hypothesis i reports the norms accumulated over samples 0..i
+            hypos_i[0]["jacobian"] = jacobian_norm[: i + 1] + [0.0] * (bsz - i - 1)
         return hypos
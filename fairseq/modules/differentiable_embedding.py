@@ -1,32 +1,71 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 class DifferentiableEmbedding(nn.Embedding):
     """ Differentiable embedding module
+
+    The forward pass is a plain embedding lookup. When `retain_input_grad`
+    is set, the gradient w.r.t. the (implicit) one-hot encoding of the input
+    tokens, of shape `(B*T, V)`, is exposed through `input_grad()`.
+
+    Only the `(B*T, D)` gradient w.r.t. the embedding output is kept; the
+    one-hot gradient `output_grad @ weight^T` is built when `input_grad()`
+    is called. It must therefore be read before the weights are updated
+    (e.g. by `optimizer.step()`); reading it afterwards raises an error
+    instead of silently using the new weights.
     """
     retain_input_grad: bool = False
-    one_hot: torch.Tensor = None
-        
+    output_grad: torch.Tensor = None
+    # incremented on every forward, so hooks of older forwards can be ignored
+    _generation: int = 0
+    # (storage, version) of the weights seen by the backward pass
+    _weight_key = None
+
+    def _current_weight_key(self):
+        return (self.weight.data_ptr(), self.weight._version)
+
     def input_grad(self):
-        if self.one_hot is not None:
-            return self.one_hot.grad
-        else:
+        if self.output_grad is None:
             return None
-        
+        assert self._weight_key == self._current_weight_key(), (
+            "weights changed since the backward pass; read input_grad() "
+            "before updating them"
+        )
+        return torch.matmul(self.output_grad, self.weight.detach().t())
+
     def unset_input_grad_(self):
-        if self.one_hot is not None:
-            self.one_hot.grad = None
-    
+        self.output_grad = None
+
     def retain_input_grad_(self, retain: bool = True):
         self.retain_input_grad = retain
-    
+        if not retain:
+            self.unset_input_grad_()
+
+    def _accumulate_output_grad(self, grad: torch.Tensor, generation: int):
+        if generation != self._generation:
+            # only the latest forward's gradient is exposed
+            return
+        grad = grad.detach().reshape(-1, self.embedding_dim)
+        self._weight_key = self._current_weight_key()
+        if self.output_grad is None:
+            self.output_grad = grad.clone()
+        else:
+            self.output_grad.add_(grad)
+
     def forward(self, input: torch.Tensor) -> torch.Tensor:
-        bsz, tsz = input.shape
-        dim = self.weight.shape[1]
-        self.one_hot = nn.functional.one_hot(input.view(-1), num_classes=self.weight.shape[0]).type(self.weight.dtype)
-        
-        if self.retain_input_grad:
-            self.one_hot.requires_grad_(True)
-            self.one_hot.retain_grad()
-        
-        return torch.matmul(self.weight.T, self.one_hot.T).T.view(bsz, tsz, dim)
+        out = F.embedding(input, self.weight, self.padding_idx)
+
+        # gradients of a previous forward are stale either way
+        self.output_grad = None
+        self._generation += 1
+        if self.retain_input_grad and torch.is_grad_enabled():
+            if not out.requires_grad:
+                # frozen weights: the input is still differentiable
+                out.requires_grad_(True)
+            generation = self._generation
+            out.register_hook(
+                lambda grad: self._accumulate_output_grad(grad, generation)
+            )
+
+        return out
@@ -173,7 +173,7 @@ class ScaleNorm(nn.Module):
 
     def forward(self, x):
         def norm(t):
-            n = torch.norm(t, dim=-1, keepdim=True).clamp(min=self.eps)
+            n = torch.linalg.vector_norm(t, dim=-1, keepdim=True).clamp_min(self.eps)
             return t / n * self.g
 
         return map_first_tuple_or_el(x, norm)
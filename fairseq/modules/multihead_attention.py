@@ -19,6 +19,11 @@ try:
 except ImportError:
     _xformers_available = False
 
+# ``scale`` was added to F.scaled_dot_product_attention in PyTorch 2.1
+_sdpa_available = hasattr(F, "scaled_dot_product_attention") and tuple(
+    int(v) for v in torch.__version__.split(".")[:2]
+) >= (2, 1)
+
 from fairseq import utils
 from fairseq.modules.fairseq_dropout import FairseqDropout
 from fairseq.modules.quant_noise import quant_noise
@@ -112,6 +117,12 @@ class MultiheadAttention(FairseqIncrementalDecoder):
             self.head_dim * num_heads == self.embed_dim
         ), "embed_dim must be divisible by num_heads"
         self.scaling = self.head_dim**-0.5
+        # subclasses that override apply_sparse_mask need the explicit
+        # attention weights, so they cannot use the fused kernel
+        self.use_sdpa = (
+            _sdpa_available
+            and type(self).apply_sparse_mask is MultiheadAttention.apply_sparse_mask
+        )
 
         self.self_attention = self_attention
         self.encoder_decoder_attention = encoder_decoder_attention
@@ -466,6 +477,50 @@ class MultiheadAttention(FairseqIncrementalDecoder):
         # TODO: support returning attention weights if needed.
         return y, None
 
+    def _sdpa_attn_forward(
+        self,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        key_padding_mask: Optional[Tensor],
+        attn_mask: Optional[Tensor],
+        bsz: int,
+        tgt_len: int,
+        src_len: int,
+    ) -> Tensor:
+        """Fused attention over already projected and scaled q/k/v.
+
+        Dispatches to FlashAttention / memory-efficient kernels where
+        available, so the (bsz * num_heads, tgt_len, src_len) attention
+        weights are never materialized. Unlike the bmm/softmax path, a query
+        whose keys are all masked may get finite outputs instead of NaN,
+        depending on the kernel.
+        """
+        q = q.view(bsz, self.num_heads, tgt_len, self.head_dim)
+        k = k.view(bsz, self.num_heads, src_len, self.head_dim)
+        v = v.view(bsz, self.num_heads, src_len, self.head_dim)
+
+        mask: Optional[Tensor] = None
+        if attn_mask is not None:
+            mask = attn_mask.to(q.dtype)
+        if key_padding_mask is not None:
+            padding_mask = torch.zeros(
+                [bsz, 1, 1, src_len], dtype=q.dtype, device=q.device
+            ).masked_fill(
+                key_padding_mask.view(bsz, 1, 1, src_len).to(torch.bool),
+                float("-inf"),
+            )
+            mask = padding_mask if mask is None else mask + padding_mask
+
+        dropout_p = self.dropout_module.p
+        if not (self.training or self.dropout_module.apply_during_inference):
+            dropout_p = 0.0
+
+        attn = F.scaled_dot_product_attention(
+            q, k, v, attn_mask=mask, dropout_p=dropout_p, scale=1.0
+        )
+        return attn.reshape(bsz * self.num_heads, tgt_len, self.head_dim)
+
     def forward(
         self,
         query: Tensor,
@@ -691,6 +746,21 @@ class MultiheadAttention(FairseqIncrementalDecoder):
                 k=k, v=v, key_padding_mask=key_padding_mask, attn_mask=attn_mask
             )
 
+        if (
+            self.use_sdpa
+            and not need_weights
+            and not before_softmax
+            and not self.onnx_trace
+            and not is_tpu
+            and bsz == kv_bsz
+        ):
+            assert v is not None
+            attn = self._sdpa_attn_forward(
+                q, k, v, key_padding_mask, attn_mask, bsz, tgt_len, src_len
+            )
+            attn = attn.transpose(0, 1).contiguous().view(tgt_len, bsz, self.embed_dim)
+            return self.out_proj(attn), None
+
         if self.encoder_decoder_attention and bsz != kv_bsz:
             attn_weights = torch.einsum(
                 "bxhtd,bhsd->bxhts",
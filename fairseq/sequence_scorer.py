@@ -34,6 +34,16 @@ class SequenceScorer(object):
     @torch.no_grad()
     def generate(self, models, sample, **kwargs):
         """Score a batch of translations."""
+        avg_probs, avg_attn = self.score_models(models, sample)
+        scores = self.sequence_scores(sample, avg_probs)
+        return self.build_hypos(sample, avg_probs, avg_attn, scores)
+
+    def forward_model(self, model, net_input):
+        """Run the forward pass of a single model in the ensemble."""
+        return model(**net_input)
+
+    def score_models(self, models, sample):
+        """Return the ensemble-averaged target log-probabilities and attention."""
         net_input = sample["net_input"]
 
         def batch_for_softmax(dec_out, target):
@@ -65,7 +75,7 @@ class SequenceScorer(object):
         avg_attn = None
         for model in models:
             model.eval()
-            decoder_out = model(**net_input)
+            decoder_out = self.forward_model(model, net_input)
             attn = decoder_out[1] if len(decoder_out) > 1 else None
             if type(attn) is dict:
                 attn = attn.get("attn", None)
@@ -76,7 +86,7 @@ class SequenceScorer(object):
                 sample["target"] = tgt
                 curr_prob = model.get_normalized_probs(
                     bd, log_probs=len(models) == 1, sample=sample
-                ).data
+                )
                 if is_single:
                     probs = gather_target_probs(curr_prob, orig_target)
                 else:
@@ -111,10 +121,26 @@ class SequenceScorer(object):
             avg_probs.log_()
             if avg_attn is not None:
                 avg_attn.div_(len(models))
+        return avg_probs, avg_attn
+
+    def _start_indices(self, sample, bsz):
+        return sample["start_indices"] if "start_indices" in sample else [0] * bsz
+
+    def sequence_scores(self, sample, avg_probs):
+        """Average the positional scores of every sample in one reduction."""
+        target = sample["target"]
+        positions = torch.arange(target.size(1), device=target.device).unsqueeze(0)
+        starts = positions.new_tensor(
+            self._start_indices(sample, target.size(0))
+        ).unsqueeze(1)
+        tgt_lens = (target.ne(self.pad) & positions.ge(starts)).sum(1, keepdim=True)
+        score_mask = positions.ge(starts) & positions.lt(starts + tgt_lens)
+        return avg_probs.masked_fill(~score_mask, 0.0).sum(1) / tgt_lens.squeeze(1)
 
+    def build_hypos(self, sample, avg_probs, avg_attn, scores):
         bsz = avg_probs.size(0)
         hypos = []
-        start_idxs = sample["start_indices"] if "start_indices" in sample else [0] * bsz
+        start_idxs = self._start_indices(sample, bsz)
         for i in range(bsz):
             # remove padding from ref
             ref = (
@@ -124,7 +150,7 @@ class SequenceScorer(object):
             )
             tgt_len = ref.numel()
             avg_probs_i = avg_probs[i][start_idxs[i] : start_idxs[i] + tgt_len]
-            score_i = avg_probs_i.sum() / tgt_len
+            score_i = scores[i]
             if avg_attn is not None:
                 avg_attn_i = avg_attn[i]
                 if self.compute_alignment:
@@ -338,8 +338,11 @@ def multi_tensor_total_norm(grads, chunk_size=2048 * 32) -> torch.Tensor:
                 )
             norms.append(norm[0].to(torch.cuda.current_device()))
         else:
-            norms += [torch.norm(g, p=2, dtype=torch.float32) for g in cur_device_grads]
-    total_norm = torch.norm(torch.stack(norms))
+            norms += [
+                torch.linalg.vector_norm(g, ord=2, dtype=torch.float32)
+                for g in cur_device_grads
+            ]
+    total_norm = torch.linalg.vector_norm(torch.stack(norms))
     return total_norm
 
 
@@ -365,7 +368,7 @@ def clip_grad_norm_(params, max_norm, aggregate_norm_fn=None) -> torch.Tensor:
             return torch.tensor(0.0)
 
     if len(grads) == 1:
-        total_norm = torch.norm(grads[0], p=2, dtype=torch.float32)
+        total_norm = torch.linalg.vector_norm(grads[0], ord=2, dtype=torch.float32)
     else:
         if multi_tensor_l2norm_available:
             total_norm = multi_tensor_total_norm(grads)
@@ -380,9 +383,14 @@ def clip_grad_norm_(params, max_norm, aggregate_norm_fn=None) -> torch.Tensor:
                 device = grads[0].device
             else:
                 device = torch.device("cpu")
-            total_norm = torch.norm(
+            total_norm = torch.linalg.vector_norm(
                 torch.stack(
-                    [torch.norm(g, p=2, dtype=torch.float32).to(device) for g in grads]
+                    [
+                        torch.linalg.vector_norm(g, ord=2, dtype=torch.float32).to(
+                            device
+                        )
+                        for g in grads
+                    ]
                 )
             )
 
@@ -49,6 +49,7 @@ def eval_lm(
     remove_bos_token: bool = False,
     device: Optional[torch.device] = None,
     metric=None,
+    amp: bool = False,
 ):
     """
     Args:
@@ -77,6 +78,8 @@ def eval_lm(
             to the relevant dictionary) and remove it from the output
         device (Optional[torch.device]): device to use for evaluation
             (defaults to device of first model parameter)
+        amp (Optional[bool]): if True, run the forward pass of the jacobian
+            metric under bfloat16 autocast
     """
     if target_dictionary is None:
         target_dictionary = source_dictionary
@@ -85,7 +88,7 @@ def eval_lm(
 
     gen_timer = StopwatchMeter()
     logger.info(f"Computing metric {metric}")
-    scorer = JacobianScorer(target_dictionary, softmax_batch) if metric == "jacobian" else SequenceScorer(target_dictionary, softmax_batch)
+    scorer = JacobianScorer(target_dictionary, softmax_batch, amp=amp) if metric == "jacobian" else SequenceScorer(target_dictionary, softmax_batch)
 
     score_sum = 0.0
     count = 0
@@ -350,6 +353,7 @@ def main(cfg: DictConfig, **unused_kwargs):
         softmax_batch=cfg.eval_lm.softmax_batch,
         remove_bos_token=getattr(cfg.task, "add_bos_token", False),
         metric=cfg.common_eval.metric,
+        amp=cfg.common.amp,
     )
 
     logger.info(
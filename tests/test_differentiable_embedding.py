@@ -0,0 +1,79 @@
+import unittest
+
+import torch
+import torch.nn.functional as F
+from fairseq.modules.differentiable_embedding import DifferentiableEmbedding
+
+
+class TestDifferentiableEmbedding(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.embed = DifferentiableEmbedding(11, 4, padding_idx=1)
+        self.tokens = torch.tensor([[2, 3, 4], [5, 1, 1]])
+
+    def _reference(self):
+        one_hot = F.one_hot(self.tokens.view(-1), num_classes=11).type(
+            self.embed.weight.dtype
+        )
+        one_hot.requires_grad_(True)
+        out = torch.matmul(one_hot, self.embed.weight).view(2, 3, 4)
+        return one_hot, out
+
+    def test_forward_matches_one_hot(self):
+        _, expected = self._reference()
+        self.assertTrue(torch.allclose(self.embed(self.tokens), expected))
+
+    def test_input_grad(self):
+        self.embed.retain_input_grad_()
+        out = self.embed(self.tokens)
+        out.pow(2).sum().backward(retain_graph=True)
+        out.sum().backward()
+
+        one_hot, expected = self._reference()
+        expected.pow(2).sum().backward(retain_graph=True)
+        expected.sum().backward()
+        self.assertEqual(self.embed.input_grad().shape, (6, 11))
+        self.assertTrue(torch.allclose(self.embed.input_grad(), one_hot.grad))
+
+        self.embed.unset_input_grad_()
+        self.assertIsNone(self.embed.input_grad())
+
+    def test_input_grad_released(self):
+        self.embed.retain_input_grad_()
+        self.embed(self.tokens).sum().backward()
+        self.assertIsNotNone(self.embed.input_grad())
+
+        self.embed.retain_input_grad_(False)
+        self.assertIsNone(self.embed.input_grad())
+
+        self.embed.retain_input_grad_()
+        self.embed(self.tokens).sum().backward()
+        self.embed(self.tokens)
+        self.assertIsNone(self.embed.input_grad())
+
+    def test_input_grad_of_latest_forward(self):
+        self.embed.retain_input_grad_()
+        other = self.embed(torch.tensor([[6, 7]]))
+        out = self.embed(self.tokens)
+        (other.pow(2).sum() + out.pow(2).sum()).backward()
+
+        one_hot, expected = self._reference()
+        expected.pow(2).sum().backward()
+        self.assertEqual(self.embed.input_grad().shape, (6, 11))
+        self.assertTrue(torch.allclose(self.embed.input_grad(), one_hot.grad))
+
+    def test_input_grad_after_weight_update(self):
+        self.embed.retain_input_grad_()
+        self.embed(self.tokens).sum().backward()
+        with torch.no_grad():
+            self.embed.weight.add_(1.0)
+        with self.assertRaises(AssertionError):
+            self.embed.input_grad()
+
+    def test_no_input_grad_by_default(self):
+        self.embed(self.tokens).sum().backward()
+        self.assertIsNone(self.embed.input_grad())
+
+
+if __name__ == "__main__":
+    unittest.main()
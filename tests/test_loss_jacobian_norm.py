@@ -0,0 +1,157 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import copy
+import unittest
+
+import torch
+from fairseq import utils
+from fairseq.loss_jacobian_norm import SequenceScorer as JacobianScorer
+from fairseq.loss_jacobian_norm import frozen_parameters
+from fairseq.models.transformer import TransformerModel
+from fairseq.sequence_scorer import SequenceScorer
+from tests.test_sequence_generator import get_dummy_task_and_parser
+
+
+def build_model(task, parser, seed):
+    torch.manual_seed(seed)
+    TransformerModel.add_args(parser)
+    args = parser.parse_args([])
+    args.encoder_layers = 2
+    args.decoder_layers = 1
+    args.encoder_embed_dim = args.decoder_embed_dim = 16
+    args.encoder_ffn_embed_dim = args.decoder_ffn_embed_dim = 32
+    args.encoder_attention_heads = args.decoder_attention_heads = 2
+    return TransformerModel.build_model(args, task).eval()
+
+
+def reference_scores(models, sample, pad):
+    """Per-sample slice means of the ensemble log-probabilities."""
+    probs = None
+    for model in models:
+        decoder_out = model(**sample["net_input"])
+        curr_prob = model.get_normalized_probs(
+            decoder_out, log_probs=len(models) == 1, sample=sample
+        ).gather(dim=2, index=sample["target"].unsqueeze(-1)).squeeze(-1)
+        probs = curr_prob if probs is None else probs + curr_prob
+    if len(models) > 1:
+        probs = (probs / len(models)).log()
+    bsz = probs.size(0)
+    starts = sample.get("start_indices", [0] * bsz)
+    scores, positional_scores = [], []
+    for i in range(bsz):
+        tgt_len = utils.strip_pad(sample["target"][i, starts[i] :], pad).numel()
+        probs_i = probs[i][starts[i] : starts[i] + tgt_len]
+        positional_scores.append(probs_i)
+        scores.append(probs_i.sum() / tgt_len)
+    return scores, positional_scores
+
+
+def reference_jacobians(model, sample, pad):
+    """Per-sample backward passes and explicit ``grad @ W^T`` norms."""
+    captured = {}
+
+    def hook(module, input, output):
+        output.retain_grad()
+        captured["output"] = output
+
+    handle = model.encoder.embed_tokens.register_forward_hook(hook)
+    scores, _ = reference_scores([model], sample, pad)
+    handle.remove()
+    weight = model.encoder.embed_tokens.weight
+    jacobians = []
+    for score in scores:
+        score.backward(retain_graph=True)
+        jacobian = torch.matmul(captured["output"].grad, weight.T)
+        jacobians.append(
+            torch.norm(jacobian.view(len(scores), -1), p=2, dim=1).tolist()
+        )
+    model.zero_grad()
+    return jacobians
+
+
+class TestJacobianScorer(unittest.TestCase):
+    def setUp(self):
+        self.task, parser = get_dummy_task_and_parser()
+        self.models = [
+            build_model(self.task, copy.deepcopy(parser), seed) for seed in (0, 1)
+        ]
+        d = self.task.target_dictionary
+        self.pad = d.pad()
+
+        torch.manual_seed(2)
+        src_tokens = torch.randint(4, len(d), (3, 6))
+        src_tokens[2, :2] = self.pad  # left-padded source
+        target = torch.randint(4, len(d), (3, 5))
+        target[0, 2] = self.pad  # interior pad
+        target[1, -2:] = self.pad
+        self.sample = {
+            "net_input": {
+                "src_tokens": src_tokens,
+                "src_lengths": torch.LongTensor([6, 6, 4]),
+                "prev_output_tokens": torch.randint(4, len(d), (3, 5)),
+            },
+            "target": target,
+        }
+
+    def _samples(self):
+        with_starts = copy.deepcopy(self.sample)
+        with_starts["start_indices"] = [1, 0, 2]
+        return [self.sample, with_starts]
+
+    def assertHyposMatch(self, hypos, scores, positional_scores):
+        self.assertEqual(len(hypos), len(scores))
+        for hypo, score, pos in zip(hypos, scores, positional_scores):
+            self.assertTrue(torch.allclose(hypo[0]["score"], score, atol=1e-6))
+            self.assertTrue(torch.allclose(hypo[0]["positional_scores"], pos))
+
+    def test_sequence_scorer_parity(self):
+        for sample in self._samples():
+            for models in (self.models[:1], self.models):
+                with torch.no_grad():
+                    scores, pos = reference_scores(models, sample, self.pad)
+                hypos = SequenceScorer(self.task.target_dictionary).generate(
+                    models, copy.deepcopy(sample)
+                )
+                self.assertHyposMatch(hypos, scores, pos)
+
+    def test_jacobian_scorer_parity(self):
+        for sample in self._samples():
+            model = self.models[0]
+            scores, pos = reference_scores([model], sample, self.pad)
+            expected = reference_jacobians(model, sample, self.pad)
+            hypos = JacobianScorer(self.task.target_dictionary).generate(
+                [model], copy.deepcopy(sample)
+            )
+            self.assertHyposMatch(hypos, scores, pos)
+            for hypo, jacobian in zip(hypos, expected):
+                self.assertTrue(
+                    torch.allclose(
+                        torch.tensor(hypo[0]["jacobian"]),
+                        torch.tensor(jacobian),
+                        rtol=1e-4,
+                        atol=1e-6,
+                    )
+                )
+            # no parameter gradients are computed
+            for p in model.parameters():
+                self.assertIsNone(p.grad)
+
+    def test_frozen_parameters(self):
+        model = self.models[0]
+        frozen = next(model.parameters())
+        frozen.requires_grad_(False)
+        with self.assertRaises(RuntimeError):
+            with frozen_parameters(model):
+                self.assertFalse(any(p.requires_grad for p in model.parameters()))
+                raise RuntimeError
+        self.assertFalse(frozen.requires_grad)
+        self.assertTrue(
+            all(p.requires_grad for p in model.parameters() if p is not frozen)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -409,6 +409,72 @@ def test_add_bias_parity():
     assert torch.equal(a_mask_orig, a_mask_new)
 
 
+@pytest.mark.parametrize("device", DEVICE)
+@pytest.mark.parametrize("encoder_decoder_attention", [False, True])
+@pytest.mark.parametrize("add_zero_attn", [False, True])
+def test_sdpa_incremental_parity(device, encoder_decoder_attention, add_zero_attn):
+    _reset_seeds()
+    tgt_len, src_len, bsz, embed_dim = 4, 6, 3, 16
+    mha = (
+        MultiheadAttention(
+            embed_dim,
+            4,
+            self_attention=not encoder_decoder_attention,
+            encoder_decoder_attention=encoder_decoder_attention,
+            add_zero_attn=add_zero_attn,
+        )
+        .to(device)
+        .eval()
+    )
+    if not mha.use_sdpa:
+        pytest.skip("scaled_dot_product_attention is not available")
+
+    query = torch.rand(tgt_len, bsz, embed_dim, device=device)
+    memory = torch.rand(src_len, bsz, embed_dim, device=device)
+    key_padding_mask = torch.zeros(bsz, src_len, dtype=torch.bool, device=device)
+    key_padding_mask[1, -2:] = True
+    # additive mask over the keys of each step; key 0 is never masked, so no
+    # row is fully masked (the fused kernel does not return NaN for those)
+    num_keys = src_len if encoder_decoder_attention else tgt_len
+    attn_mask = torch.zeros(tgt_len, num_keys, device=device).masked_fill(
+        torch.rand(tgt_len, num_keys, device=device) < 0.4, float("-inf")
+    )
+    attn_mask[:, 0] = 0
+
+    def decode(use_sdpa):
+        mha.use_sdpa = use_sdpa
+        incremental_state = {}
+        outputs = []
+        for t in range(tgt_len):
+            x = query[t : t + 1]
+            if encoder_decoder_attention:
+                y, _ = mha(
+                    x,
+                    memory,
+                    memory,
+                    key_padding_mask=key_padding_mask,
+                    incremental_state=incremental_state,
+                    static_kv=True,
+                    need_weights=False,
+                    attn_mask=attn_mask[t : t + 1],
+                )
+            else:
+                y, _ = mha(
+                    x,
+                    x,
+                    x,
+                    incremental_state=incremental_state,
+                    need_weights=False,
+                    attn_mask=attn_mask[t : t + 1, : t + 1],
+                )
+            outputs.append(y)
+        return torch.cat(outputs)
+
+    expected = decode(False)
+    assert not torch.isnan(expected).any()
+    assert torch.allclose(decode(True), expected, atol=1e-6)
+
+
 class TestMultiheadAttention(unittest.TestCase):
     def test_append_prev_key_padding_mask(self):
         bsz = 1